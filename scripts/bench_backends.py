@@ -0,0 +1,97 @@
+# scripts/bench_backends.py
+"""
+Benchmark pandas vs duckdb backend on synthetic hourly data.
+
+    python -m scripts.bench_backends --rows 20000000 --memory-limit 1GB
+
+The numbers quoted when the duckdb backend was added came from
+
+    python -m scripts.bench_backends --rows 15000000 --memory-limit 500MB --threads 1
+
+Each backend runs in its own process so peak RSS is measured separately.
+Both read the same Parquet file and write their results to Parquet; the
+duckdb backend does it with out=... so results never pass through pandas.
+"""
+from __future__ import annotations
+import argparse
+import multiprocessing as mp
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def make_data(path: Path, rows: int, locations: int = 2000, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "location_name": pd.Series(rng.integers(0, locations, rows)).map(lambda i: f"loc_{i}"),
+        "hour": pd.Timestamp("2020-01-01", tz="UTC")
+                + pd.to_timedelta(rng.integers(0, 24 * 365 * 5, rows), unit="h"),
+        "volume_hour": rng.integers(0, 2000, rows),
+    })
+    df.to_parquet(path, index=False)
+
+
+def _peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+def _run(backend: str, src: Path, workdir: Path,
+         memory_limit: str | None, threads: int | None, q) -> None:
+    t0 = time.perf_counter()
+    if backend == "pandas":
+        from src.metrics import compute_hourly_baseline, attach_ci, attach_ci_leave1out
+        df = pd.read_parquet(src)
+        base = compute_hourly_baseline(df, "volume_hour")
+        base.to_parquet(workdir / "baseline.parquet", index=False)
+        attach_ci(df, base, "volume_hour").to_parquet(workdir / "ci.parquet", index=False)
+        attach_ci_leave1out(df).to_parquet(workdir / "ci_l1o.parquet", index=False)
+    else:
+        from src import metrics_sql
+        con = metrics_sql.connect(memory_limit=memory_limit, temp_directory=workdir / "spill",
+                                  threads=threads)
+        base = metrics_sql.compute_hourly_baseline(src, "volume_hour", con=con,
+                                                   out=workdir / "baseline.parquet")
+        metrics_sql.attach_ci(src, base, "volume_hour", con=con, out=workdir / "ci.parquet")
+        metrics_sql.attach_ci_leave1out(src, con=con, out=workdir / "ci_l1o.parquet")
+    q.put((time.perf_counter() - t0, _peak_rss_mb()))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=5_000_000)
+    ap.add_argument("--memory-limit", default=None, help="duckdb memory_limit, e.g. 1GB")
+    ap.add_argument("--threads", type=int, default=None, help="duckdb threads (default: all cores)")
+    ap.add_argument("--backends", nargs="+", default=["pandas", "duckdb"])
+    args = ap.parse_args()
+
+    ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        src = tmp / "hourly.parquet"
+        # generate in a child too: ru_maxrss survives fork+exec, so the parent
+        # must never hold the full DataFrame or it would inflate every reading
+        p = ctx.Process(target=make_data, args=(src, args.rows))
+        p.start()
+        p.join()
+        print(f"rows={args.rows:,}  parquet={src.stat().st_size / 1024 ** 2:.0f} MB")
+        for backend in args.backends:
+            q = ctx.Queue()
+            p = ctx.Process(target=_run, args=(backend, src, tmp, args.memory_limit, args.threads, q))
+            p.start()
+            p.join()
+            if p.exitcode != 0:
+                print(f"{backend:>7}: failed (exit code {p.exitcode})")
+                continue
+            secs, rss = q.get()
+            print(f"{backend:>7}: {secs:8.2f} s   peak RSS {rss:8.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,15 @@ def _classify_ci(ci: float, low_thr: float = 0.8, high_thr: float = 1.2) -> str:
     return "high"
 
 
+def _sql_backend(backend: str):
+    """Return the SQL backend module for `backend`, or None for plain pandas."""
+    if backend == "pandas":
+        return None
+    if backend == "duckdb":
+        from src import metrics_sql
+        return metrics_sql
+    raise ValueError("backend must be 'pandas' or 'duckdb'")
+
 
 # ---------------------------
 # Baseline (simple mean) + attach
@@ -29,13 +38,18 @@ def compute_hourly_baseline(df: pd.DataFrame,
                             value_col: str,
                             time_col: str = "hour",
                             keys: list[str] | None = None,
-                            by: str = "weekday_hour") -> pd.DataFrame:
+                            by: str = "weekday_hour",
+                            backend: str = "pandas") -> pd.DataFrame:
     """
     Calculate a baseline mean for each group.
     by:
         - 'weekday_hour': group by weekday (0=Mon) & hour_of_day
         - 'hour_of_day':  group only by hour_of_day
+    backend: 'pandas' or 'duckdb' (out-of-core, see src/metrics_sql.py)
     """
+    sql = _sql_backend(backend)
+    if sql is not None:
+        return sql.compute_hourly_baseline(df, value_col, time_col, keys, by)
     if keys is None:
         keys = ["location_name"]
 
@@ -65,10 +79,14 @@ def attach_ci(df: pd.DataFrame,
               how: str = "weekday_hour",
               keys: list[str] | None = None,
               low_thr: float = 0.8,
-              high_thr: float = 1.2) -> pd.DataFrame:
+              high_thr: float = 1.2,
+              backend: str = "pandas") -> pd.DataFrame:
     """
     Merge baseline back and compute CI = current / baseline_mean.
     """
+    sql = _sql_backend(backend)
+    if sql is not None:
+        return sql.attach_ci(df, baseline, value_col, how, keys, low_thr, high_thr)
     if keys is None:
         keys = ["location_name"]
 
@@ -95,13 +113,18 @@ def attach_ci_leave1out(df: pd.DataFrame,
                         time_col: str = "hour",
                         keys: list[str] | None = None,
                         low_thr: float = 0.8,
-                        high_thr: float = 1.2) -> pd.DataFrame:
+                        high_thr: float = 1.2,
+                        backend: str = "pandas") -> pd.DataFrame:
     """
     对每条记录，baseline = 同组其它记录的平均值（自身被排除）。
     group = keys + weekday + hour_of_day
 
     若该组合仅 1 条记录，则 baseline_mean 为空，ci_level='unknown'。
+    backend='duckdb' 时在 DuckDB 中计算，可超出内存（见 src/metrics_sql.py）。
     """
+    sql = _sql_backend(backend)
+    if sql is not None:
+        return sql.attach_ci_leave1out(df, value_col, time_col, keys, low_thr, high_thr)
     if keys is None:
         keys = ["location_name"]
 
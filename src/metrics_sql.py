@@ -0,0 +1,400 @@
+# src/metrics_sql.py
+"""
+Out-of-core backend for src.metrics, built on DuckDB.
+
+Same semantics as the pandas functions in src.metrics, but the input can be
+a DataFrame *or* a path / glob to CSV or Parquet files, so the full history
+never has to be loaded into pandas. DuckDB spills to `temp_directory` when a
+query exceeds `memory_limit`.
+
+Pass `out=<path>` to write the result straight to Parquet (COPY ... TO)
+instead of returning a DataFrame.
+"""
+from __future__ import annotations
+from pathlib import Path
+import glob
+import itertools
+import json
+import pandas as pd
+
+from src.loaders import RAW_DIR
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+_view_ids = itertools.count()
+
+
+# ---------------------------
+# Utils
+# ---------------------------
+def connect(database: str = ":memory:",
+            memory_limit: str | None = None,
+            temp_directory: str | Path | None = None,
+            threads: int | None = None):
+    """
+    Open a DuckDB connection for the functions below.
+    memory_limit:   e.g. '2GB'; above it DuckDB spills to temp_directory
+    temp_directory: where spill files go (default: DuckDB's own choice)
+    """
+    if duckdb is None:
+        raise ImportError("backend='duckdb' needs the duckdb package: pip install duckdb")
+    con = duckdb.connect(database)
+    if memory_limit is not None:
+        con.execute(f"SET memory_limit = {_lit(memory_limit)}")
+    if temp_directory is not None:
+        con.execute(f"SET temp_directory = {_lit(str(temp_directory))}")
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+    # row order of the result must follow the input, like pandas
+    con.execute("SET preserve_insertion_order = true")
+    return con
+
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _lit(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _timezone(con) -> str:
+    return con.execute("SELECT current_setting('TimeZone')").fetchone()[0]
+
+
+def _parquet_tz(con, path: str, time_col: str) -> str:
+    """
+    Timezone pandas stored for `time_col` in the Parquet metadata. DuckDB reads
+    the column as an instant and drops the zone, so it has to come from here.
+    """
+    zones = set()
+    rows = con.execute("SELECT value FROM parquet_kv_metadata(?) WHERE key = 'pandas'",
+                       [path]).fetchall()
+    for (value,) in rows:
+        for col in json.loads(bytes(value))["columns"]:
+            if col["name"] == time_col and col.get("metadata"):
+                zones.add(col["metadata"].get("timezone") or "UTC")
+    if len(zones) > 1:
+        raise ValueError(f"{path}: {time_col} has mixed timezones {sorted(zones)}")
+    return zones.pop() if zones else "UTC"
+
+
+def _register(con, source, time_col: str | None = None) -> tuple[str, list[str]]:
+    """
+    Expose `source` (DataFrame / .csv / .parquet path or glob) as a view.
+    Also sets the session TimeZone so hour/weekday match pandas' .dt accessors;
+    callers save it with _timezone() first and restore it when done.
+    Returns (view name, column names).
+    """
+    name = f"src_{next(_view_ids)}"
+    tz = "UTC"  # loaders parse everything with utc=True
+    if isinstance(source, pd.DataFrame):
+        con.register(name, source)
+        if time_col is not None and time_col in source.columns:
+            tz = str(getattr(source[time_col].dtype, "tz", None) or "UTC")
+    else:
+        path = str(source)
+        if path.endswith(".parquet"):
+            reader = f"read_parquet({_lit(path)}, union_by_name = true)"
+            if time_col is not None:
+                tz = _parquet_tz(con, path, time_col)
+        elif path.endswith(".csv"):
+            reader = f"read_csv({_lit(path)}, union_by_name = true)"
+        else:
+            raise ValueError(f"{path}: source must be a DataFrame, .csv or .parquet")
+        con.execute(f"CREATE OR REPLACE TEMP VIEW {name} AS SELECT * FROM {reader}")
+    if time_col is not None:
+        con.execute(f"SET TimeZone = {_lit(tz)}")
+    return name, con.table(name).columns
+
+
+def _unregister(con, name: str, source) -> None:
+    if isinstance(source, pd.DataFrame):
+        con.unregister(name)
+    else:
+        con.execute(f"DROP VIEW IF EXISTS {name}")
+
+
+def _select(cols: list[str], derived: dict[str, str]) -> tuple[str, list[str]]:
+    """
+    SELECT list that assigns `derived` columns the way `df[col] = ...` does:
+    existing columns are replaced in place, new ones are appended.
+    """
+    exprs = [f"{derived[c]} AS {_q(c)}" if c in derived else _q(c) for c in cols]
+    new = [c for c in derived if c not in cols]
+    exprs += [f"{derived[c]} AS {_q(c)}" for c in new]
+    return ", ".join(exprs), cols + new
+
+
+def _time_parts(con, name: str, time_col: str, by: str) -> dict[str, str]:
+    t = _q(time_col)
+    ttype = dict(zip(con.table(name).columns, con.table(name).types))[time_col]
+    tz = _timezone(con)
+    if str(ttype) == "TIMESTAMP WITH TIME ZONE" and tz == "UTC":
+        # hour()/isodow() on TIMESTAMPTZ go through ICU and dominate the run
+        # time; in UTC plain epoch arithmetic gives the same answer
+        day = 86_400_000_000
+        us = f"((epoch_us({t}) % {day} + {day}) % {day})"
+        hour = f"CAST({us} // 3600000000 AS INTEGER)"
+        # 1970-01-01 was a Thursday (dayofweek 3)
+        weekday = f"CAST((((epoch_us({t}) - {us}) // {day} + 3) % 7 + 7) % 7 AS INTEGER)"
+    else:
+        hour = f"CAST(hour({t}) AS INTEGER)"
+        # isodow: 1=Mon .. 7=Sun  -> pandas dayofweek 0=Mon
+        weekday = f"CAST(isodow({t}) - 1 AS INTEGER)"
+    if by == "weekday_hour":
+        return {"weekday": weekday, "hour_of_day": hour}
+    return {"hour_of_day": hour}
+
+
+def _ci_level(ci: str, low_thr: float, high_thr: float) -> str:
+    # same rules as metrics._classify_ci; NaN sorts above everything in DuckDB,
+    # so it has to be caught before the comparisons
+    return (f"CASE WHEN {ci} IS NULL OR isnan({ci}) OR isinf({ci}) THEN 'unknown' "
+            f"WHEN {ci} < {float(low_thr)!r} THEN 'low' "
+            f"WHEN {ci} <= {float(high_thr)!r} THEN 'normal' "
+            f"ELSE 'high' END")
+
+
+def _finish(con, sql: str, out: str | Path | None) -> pd.DataFrame | Path:
+    if out is None:
+        df = con.execute(sql).df()
+        # DuckDB returns nullable Int* for integer columns with NULLs;
+        # pandas merges upcast those to float64 with NaN
+        for c in df.columns:
+            if (isinstance(df[c].dtype, pd.api.extensions.ExtensionDtype)
+                    and pd.api.types.is_integer_dtype(df[c].dtype)):
+                df[c] = df[c].astype("float64")
+        if df.empty:
+            # on no rows DuckDB can't infer strings and gives object; pandas
+            # keeps its default string dtype, and ci.apply(...) stays float64
+            for c in df.columns:
+                if df[c].dtype == object:
+                    df[c] = df[c].astype("float64" if c == "ci_level" else "str")
+        return df
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    con.execute(f"COPY ({sql}) TO {_lit(str(out))} (FORMAT parquet)")
+    return out
+
+
+# ---------------------------
+# Hourly volume straight from the raw CSVs
+# ---------------------------
+def load_hourly_volume(pattern: str = "toronto_volume_2020_2024*.csv",
+                       con=None,
+                       out: str | Path | None = None) -> pd.DataFrame | Path:
+    """
+    SQL version of `load_volume()` + hourly sum (scripts/build_ci.py step 1,
+    before the coords merge). Returns location_name, hour, volume_hour;
+    sorted like pandas groupby.
+    """
+    path = str(RAW_DIR / pattern)
+    if not glob.glob(path):
+        raise FileNotFoundError("No volume csv matched.")
+
+    con = con or connect()
+    prev_tz = _timezone(con)
+    con.execute("SET TimeZone = 'UTC'")
+    src = f"read_csv({_lit(path)}, union_by_name = true, normalize_names = true, all_varchar = true)"
+    # to_numeric(...).fillna(0).astype(int) truncates, so trunc before the cast
+    sql = f"""
+        SELECT location_name,
+               date_trunc('hour', ts) AS hour,
+               CAST(SUM(vol) AS BIGINT) AS volume_hour
+        FROM (
+            SELECT location_name,
+                   TRY_CAST(time_start AS TIMESTAMPTZ) AS ts,
+                   COALESCE(TRY_CAST(trunc(TRY_CAST(volume_15min AS DOUBLE)) AS BIGINT), 0) AS vol
+            FROM {src}
+        )
+        -- groupby(["location_name", "hour"]) drops NaN keys
+        WHERE ts IS NOT NULL AND location_name IS NOT NULL
+        GROUP BY location_name, hour
+        ORDER BY location_name, hour
+    """
+    try:
+        return _finish(con, sql, out)
+    finally:
+        con.execute(f"SET TimeZone = {_lit(prev_tz)}")
+
+
+# ---------------------------
+# Baseline (simple mean) + attach
+# ---------------------------
+def compute_hourly_baseline(source,
+                            value_col: str,
+                            time_col: str = "hour",
+                            keys: list[str] | None = None,
+                            by: str = "weekday_hour",
+                            con=None,
+                            out: str | Path | None = None) -> pd.DataFrame | Path:
+    """
+    See metrics.compute_hourly_baseline. `source` may be a DataFrame or a
+    .csv/.parquet path (globs allowed).
+    """
+    if keys is None:
+        keys = ["location_name"]
+    if by not in ("weekday_hour", "hour_of_day"):
+        raise ValueError("by must be 'weekday_hour' or 'hour_of_day'")
+
+    con = con or connect()
+    prev_tz = _timezone(con)
+    name, cols = _register(con, source, time_col)
+    try:
+        parts = _time_parts(con, name, time_col, by)
+        group_cols = ", ".join(_q(c) for c in keys + list(parts))
+        select, _ = _select(cols, parts)
+        # favg: compensated sum like pandas' groupby mean (cf. fsum below);
+        # it turns inf into NaN, so groups holding an inf use plain AVG
+        v = _q(value_col)
+        vtype = dict(zip(con.table(name).columns, con.table(name).types))[value_col]
+        mean = (f"CASE WHEN bool_or(isinf({v})) THEN AVG({v}) ELSE favg({v}) END"
+                if str(vtype).upper() in ("FLOAT", "DOUBLE") else f"favg({v})")
+        sql = f"""
+            SELECT {group_cols}, {mean} AS baseline_mean
+            FROM (SELECT {select} FROM {name})
+            GROUP BY {group_cols}
+            ORDER BY {group_cols}
+        """
+        return _finish(con, sql, out)
+    finally:
+        _unregister(con, name, source)
+        con.execute(f"SET TimeZone = {_lit(prev_tz)}")
+
+
+def attach_ci(source,
+              baseline,
+              value_col: str,
+              how: str = "weekday_hour",
+              keys: list[str] | None = None,
+              low_thr: float = 0.8,
+              high_thr: float = 1.2,
+              con=None,
+              out: str | Path | None = None) -> pd.DataFrame | Path:
+    """
+    See metrics.attach_ci. Both `source` and `baseline` may be a DataFrame
+    or a .csv/.parquet path.
+    """
+    if keys is None:
+        keys = ["location_name"]
+
+    con = con or connect()
+    prev_tz = _timezone(con)
+    bname, bcols = _register(con, baseline)
+    try:
+        name, cols = _register(con, source, "hour")
+        try:
+            parts = _time_parts(con, name, "hour", how)
+            merge_cols = keys + list(parts)
+            select, cols = _select(cols, parts)
+            extra = [c for c in bcols if c not in merge_cols]
+            # pandas merge matches NaN keys to each other
+            on = " AND ".join(f"d.{_q(c)} IS NOT DISTINCT FROM b.{_q(c)}" for c in merge_cols)
+            joined = ", ".join([f"d.{_q(c)}" for c in cols] + [f"b.{_q(c)}" for c in extra])
+            cols = cols + extra
+
+            v, b = _q(value_col), '"baseline_mean"'
+            # plain division like pandas: x/0 -> +-inf, 0/0 -> NaN
+            ci = (f"CASE WHEN {v} IS NULL OR {b} IS NULL THEN NULL "
+                  f"WHEN {b} = 0 THEN CAST(CASE WHEN {v} > 0 THEN 'inf' WHEN {v} < 0 THEN '-inf' "
+                  f"ELSE 'nan' END AS DOUBLE) "
+                  f"ELSE {v} / {b} END")
+            s_ci, cols = _select(cols, {"ci": ci})
+            s_lvl, cols = _select(cols, {"ci_level": _ci_level('"ci"', low_thr, high_thr)})
+            sql = f"""
+                WITH d AS (SELECT {select}, row_number() OVER () AS __row FROM {name}),
+                     j AS (SELECT {joined}, d.__row FROM d LEFT JOIN {bname} b ON {on}),
+                     c AS (SELECT {s_ci}, __row FROM j)
+                SELECT {s_lvl} FROM c ORDER BY __row
+            """
+            return _finish(con, sql, out)
+        finally:
+            _unregister(con, name, source)
+    finally:
+        _unregister(con, bname, baseline)
+        con.execute(f"SET TimeZone = {_lit(prev_tz)}")
+
+
+# ---------------------------
+# Leave-one-out CI
+# ---------------------------
+def attach_ci_leave1out(source,
+                        value_col: str = "volume_hour",
+                        time_col: str = "hour",
+                        keys: list[str] | None = None,
+                        low_thr: float = 0.8,
+                        high_thr: float = 1.2,
+                        con=None,
+                        out: str | Path | None = None) -> pd.DataFrame | Path:
+    """
+    See metrics.attach_ci_leave1out. Group sum/count come from a hash
+    GROUP BY joined back on the group columns, like the pandas version.
+    """
+    if keys is None:
+        keys = ["location_name"]
+
+    con = con or connect()
+    prev_tz = _timezone(con)
+    name, cols = _register(con, source, time_col)
+    try:
+        parts = _time_parts(con, name, time_col, "weekday_hour")
+        grp_cols = keys + list(parts)
+        select, cols = _select(cols, parts)
+
+        v = _q(value_col)
+        vtype = dict(zip(con.table(name).columns, con.table(name).types))[value_col]
+        vtype = str(vtype).upper()
+        if vtype in ("TINYINT", "SMALLINT", "INTEGER", "BIGINT",
+                     "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT"):
+            # pandas keeps the column's dtype for the sum, except 8-bit ints
+            # which it widens to 64 bits (pandas wraps on overflow, DuckDB raises)
+            sum_fn = "SUM"
+            sum_type = {"TINYINT": "BIGINT", "UTINYINT": "UBIGINT"}.get(vtype, vtype)
+        else:
+            # pandas groupby sums floats with Kahan compensation; fsum does too
+            sum_fn = "fsum"
+            sum_type = "FLOAT" if vtype == "FLOAT" else "DOUBLE"
+        # fsum turns inf into NaN, pandas keeps it: plain SUM for those groups
+        sum_expr = (f"CASE WHEN bool_or(isinf({v})) THEN SUM({v}) ELSE fsum({v}) END"
+                    if sum_fn == "fsum" else f"SUM({v})")
+        grp = ", ".join(_q(c) for c in grp_cols)
+        # groupby(...) drops NaN keys -> those rows get no sum/count
+        not_null = " AND ".join(f"{_q(c)} IS NOT NULL" for c in grp_cols)
+        on = " AND ".join(f"d.{_q(c)} = g.{_q(c)}" for c in grp_cols)
+        joined = ", ".join([f"d.{_q(c)}" for c in cols] + ['g."sum_all"', 'g."n_all"'])
+        cols = cols + ["sum_all", "n_all"]
+        s_base, cols = _select(cols, {
+            "baseline_mean": 'CASE WHEN "n_all" IS NULL OR "n_all" <= 1 THEN NULL '
+                             f'ELSE CAST("sum_all" - {v} AS DOUBLE) / ("n_all" - 1) END',
+        })
+        b = '"baseline_mean"'
+        ci = (f"CASE WHEN {b} IS NULL OR isnan({b}) OR {b} = 0 THEN NULL "
+              f"WHEN isinf({v} / {b}) THEN NULL ELSE {v} / {b} END")
+        s_ci, cols = _select(cols, {"ci": ci})
+        s_lvl, cols = _select(cols, {"ci_level": _ci_level('"ci"', low_thr, high_thr)})
+        # pandas runs replace([inf, -inf], nan) over the whole frame
+        floats = [c for c, t in zip(con.table(name).columns, con.table(name).types)
+                  if str(t).upper() in ("FLOAT", "DOUBLE") and c not in parts]
+        floats += ["baseline_mean", "ci"] + (["sum_all"] if sum_fn == "fsum" else [])
+        s_inf, cols = _select(cols, {
+            c: f"CASE WHEN isinf({_q(c)}) THEN NULL ELSE {_q(c)} END" for c in floats})
+        sql = f"""
+            WITH d AS (SELECT {select}, row_number() OVER () AS __row FROM {name}),
+                 g AS (SELECT {grp},
+                              CAST(COALESCE({sum_expr}, 0) AS {sum_type}) AS "sum_all",
+                              COUNT({v}) AS "n_all"
+                       FROM d WHERE {not_null} GROUP BY {grp}),
+                 a AS (SELECT {joined}, d.__row FROM d LEFT JOIN g ON {on}),
+                 m AS (SELECT {s_base}, __row FROM a),
+                 c AS (SELECT {s_ci}, __row FROM m),
+                 l AS (SELECT {s_lvl}, __row FROM c)
+            SELECT {s_inf} FROM l ORDER BY __row
+        """
+        return _finish(con, sql, out)
+    finally:
+        _unregister(con, name, source)
+        con.execute(f"SET TimeZone = {_lit(prev_tz)}")
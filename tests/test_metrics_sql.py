@@ -0,0 +1,163 @@
+# tests/test_metrics_sql.py
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("duckdb")
+
+from src import loaders, metrics_sql
+from src.metrics import compute_hourly_baseline, attach_ci, attach_ci_leave1out
+
+
+def _hourly(n: int = 20_000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "location_name": rng.choice(["A", "B", "C", None], n),
+        "hour": pd.Timestamp("2021-01-01", tz="UTC")
+                + pd.to_timedelta(rng.integers(0, 24 * 60, n), unit="h"),
+        "volume_hour": rng.integers(0, 50, n),
+    })
+    return df  # unsorted on purpose: output order must follow input
+
+
+@pytest.mark.parametrize("by", ["weekday_hour", "hour_of_day"])
+def test_baseline_matches_pandas(by):
+    df = _hourly()
+    exp = compute_hourly_baseline(df, "volume_hour", by=by)
+    got = compute_hourly_baseline(df, "volume_hour", by=by, backend="duckdb")
+    pd.testing.assert_frame_equal(exp, got, check_exact=True)
+
+
+def test_baseline_float_values():
+    df = _hourly()
+    df["volume_hour"] = df["volume_hour"] * 1.1
+    df.loc[::7, "volume_hour"] = np.nan
+    df.loc[::97, "volume_hour"] = np.inf
+    exp = compute_hourly_baseline(df, "volume_hour")
+    got = compute_hourly_baseline(df, "volume_hour", backend="duckdb")
+    # both sides use compensated summation, but in a different order, so a
+    # few float means can still differ in the last ulp
+    pd.testing.assert_frame_equal(exp, got, check_exact=False, rtol=1e-12)
+
+
+def test_attach_ci_matches_pandas():
+    df = _hourly()
+    base = compute_hourly_baseline(df, "volume_hour")
+    base.loc[::5, "baseline_mean"] = 0  # x/0 -> inf -> 'unknown'
+    exp = attach_ci(df, base, "volume_hour")
+    got = attach_ci(df, base, "volume_hour", backend="duckdb")
+    pd.testing.assert_frame_equal(exp, got, check_exact=True)
+
+
+@pytest.mark.parametrize("dtype", ["int64", "int32", "int8", "uint16", "float32"])
+def test_leave1out_matches_pandas(dtype):
+    df = _hourly()
+    df["volume_hour"] = df["volume_hour"].astype(dtype)
+    exp = attach_ci_leave1out(df)
+    got = attach_ci_leave1out(df, backend="duckdb")
+    pd.testing.assert_frame_equal(exp, got, check_exact=True)
+
+
+def test_leave1out_clears_inf_everywhere():
+    df = _hourly()
+    df["volume_hour"] = df["volume_hour"].astype("float64")
+    df["speed"] = 1.5  # passthrough float column
+    df.loc[::97, "volume_hour"] = np.inf
+    df.loc[::89, "speed"] = -np.inf
+    exp = attach_ci_leave1out(df)
+    got = attach_ci_leave1out(df, backend="duckdb")
+    pd.testing.assert_frame_equal(exp, got, check_exact=True)
+
+
+def test_leave1out_from_parquet(tmp_path):
+    df = _hourly().dropna(subset=["location_name"]).reset_index(drop=True)
+    path = tmp_path / "hourly.parquet"
+    df.to_parquet(path, index=False)
+    exp = attach_ci_leave1out(df)
+    got = metrics_sql.attach_ci_leave1out(path)
+    pd.testing.assert_frame_equal(exp, got, check_exact=True)
+
+    out = metrics_sql.attach_ci_leave1out(path, out=tmp_path / "ci.parquet")
+    assert len(pd.read_parquet(out)) == len(df)
+
+
+def test_parquet_keeps_local_timezone(tmp_path):
+    df = _hourly()
+    df["hour"] = df["hour"].dt.tz_convert("America/Toronto")
+    path = tmp_path / "hourly.parquet"
+    df.to_parquet(path, index=False)
+    df = pd.read_parquet(path)
+    exp = compute_hourly_baseline(df, "volume_hour")
+    got = metrics_sql.compute_hourly_baseline(path, "volume_hour")
+    pd.testing.assert_frame_equal(exp, got, check_exact=True)
+    pd.testing.assert_frame_equal(attach_ci_leave1out(df),
+                                  metrics_sql.attach_ci_leave1out(path), check_exact=True)
+
+
+def test_csv_and_parquet_glob_sources(tmp_path):
+    df = _hourly().dropna(subset=["location_name"]).reset_index(drop=True)
+    csv = tmp_path / "hourly.csv"
+    df.to_csv(csv, index=False)
+    for i, part in enumerate(np.array_split(np.arange(len(df)), 3)):
+        df.iloc[part].to_parquet(tmp_path / f"part_{i}.parquet", index=False)
+
+    exp = attach_ci_leave1out(df)
+    base = compute_hourly_baseline(df, "volume_hour")
+    exp_ci = attach_ci(df, base, "volume_hour")
+    for src in (csv, tmp_path / "part_*.parquet"):
+        got = metrics_sql.attach_ci_leave1out(src)
+        pd.testing.assert_frame_equal(exp, got, check_exact=True)
+        got = metrics_sql.attach_ci(src, base, "volume_hour")
+        pd.testing.assert_frame_equal(exp_ci, got, check_exact=True)
+
+
+def test_hourly_volume_matches_load_volume(tmp_path, monkeypatch):
+    raw = pd.DataFrame({
+        "Location Name": ["A St", "A St", "", "B Ave", "B Ave"],
+        "Time Start": ["2021-03-01T08:00:00", "2021-03-01T08:15:00", "2021-03-01T08:00:00",
+                       "2021-03-01T09:45:00", "bad"],
+        "Time End": ["", "", "", "", ""],
+        "Volume 15min": ["3.7", "2", "5", "x", "1"],  # fractional + non-numeric
+    })
+    raw.to_csv(tmp_path / "toronto_volume_2020_2024_a.csv", index=False)
+    monkeypatch.setattr(loaders, "RAW_DIR", tmp_path)
+    monkeypatch.setattr(metrics_sql, "RAW_DIR", tmp_path)
+
+    veh = loaders.load_volume()
+    exp = (veh.groupby(["location_name", "hour"], as_index=False)["volume_15min"]
+              .sum()
+              .rename(columns={"volume_15min": "volume_hour"}))
+    got = metrics_sql.load_hourly_volume()
+    pd.testing.assert_frame_equal(exp, got)
+
+    with pytest.raises(FileNotFoundError):
+        metrics_sql.load_hourly_volume("nothing_*.csv")
+
+
+def test_caller_connection_left_untouched(tmp_path):
+    df = _hourly(2_000)
+    path = tmp_path / "hourly.parquet"
+    df.to_parquet(path, index=False)
+    con = metrics_sql.connect()
+    con.execute("SET TimeZone = 'America/Toronto'")
+    base = metrics_sql.compute_hourly_baseline(df, "volume_hour", con=con)
+    metrics_sql.attach_ci(path, base, "volume_hour", con=con)
+    metrics_sql.attach_ci_leave1out(df, con=con)
+    assert con.execute("SELECT current_setting('TimeZone')").fetchone()[0] == "America/Toronto"
+    assert con.execute("SELECT count(*) FROM duckdb_views() WHERE NOT internal").fetchone()[0] == 0
+
+
+def test_empty_frame():
+    df = _hourly().head(0)
+    base = compute_hourly_baseline(df, "volume_hour")
+    pd.testing.assert_frame_equal(base, compute_hourly_baseline(df, "volume_hour",
+                                                                backend="duckdb"))
+    pd.testing.assert_frame_equal(attach_ci(df, base, "volume_hour"),
+                                  attach_ci(df, base, "volume_hour", backend="duckdb"))
+    pd.testing.assert_frame_equal(attach_ci_leave1out(df),
+                                  attach_ci_leave1out(df, backend="duckdb"))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        attach_ci_leave1out(_hourly(10), backend="spark")